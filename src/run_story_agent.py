@@ -1,87 +1,183 @@
 #!/usr/bin/env python3
 
 import argparse
-import asyncio
-import csv
-import json
+import atexit
+import hashlib
 import os
+import re
+import sys
+import urllib.parse
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from story_agent import generate_test_cases_from_story
-from runner import run_test_suite
+import orjson
 
 
-def write_html_report(results_json: dict, html_path: Path):
-    passed = sum(1 for r in results_json.get("tests", []) if r.get("status") == "passed")
-    failed = sum(1 for r in results_json.get("tests", []) if r.get("status") == "failed")
-    total = len(results_json.get("tests", []))
+_ESC = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"})
 
-    html = f"""
+# Static report chrome; only the summary counts are formatted per report
+_HTML_HEAD = """
 <html><head><title>User Story Test Report</title>
 <style>
-body {{ font-family: Arial, sans-serif; padding: 20px; }}
-.summary {{ margin-bottom: 16px; }}
-.pass {{ color: #0a7b44; }}
-.fail {{ color: #b00020; }}
-pre {{ background: #f6f8fa; padding: 12px; border-radius: 6px; overflow: auto; }}
+body { font-family: Arial, sans-serif; padding: 20px; }
+.summary { margin-bottom: 16px; }
+.pass { color: #0a7b44; }
+.fail { color: #b00020; }
+pre { background: #f6f8fa; padding: 12px; border-radius: 6px; overflow: auto; }
 </style>
 </head><body>
   <h1>User Story Test Report</h1>
   <div class="summary">
-    <strong>Total:</strong> {total} &nbsp; <strong class="pass">Passed:</strong> {passed} &nbsp; <strong class="fail">Failed:</strong> {failed}
+"""
+_SUMMARY_TMPL = """    <strong>Total:</strong> {total} &nbsp; <strong class="pass">Passed:</strong> {passed} &nbsp; <strong class="fail">Failed:</strong> {failed}
   </div>
   <hr />
-  {''.join(render_test_result(tr) for tr in results_json.get('tests', []))}
-</body></n></html>
 """
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write(html)
-
+_HTML_TAIL = """
+</body></html>
+"""
 
-def render_test_result(test_result: dict) -> str:
-    status_class = "pass" if test_result.get("status") == "passed" else "fail"
-    name = test_result.get("name", "Unnamed Test")
-    error = test_result.get("error", "")
-    screenshot = test_result.get("screenshot", "")
-    steps_rendered = json.dumps(test_result.get("steps", []), indent=2)
-    img_tag = f"<div><img src=\"{screenshot}\" style=\"max-width: 100%; border: 1px solid #ddd;\" /></div>" if screenshot else ""
-    error_block = f"<pre>{error}</pre>" if error else ""
-    return f"""
+# Per-test report section; fields are escaped by the caller before formatting
+_SECTION_TMPL = """
   <section>
-    <h3 class="{status_class}">{name} — {test_result.get('status','unknown').upper()}</h3>
+    <h3 class="{status_class}">{name} — {status}</h3>
     <details>
       <summary>Steps</summary>
-      <pre>{steps_rendered}</pre>
+      <pre>{steps}</pre>
     </details>
-    {img_tag}
-    {error_block}
-  </section>
+{img}{error}  </section>
   <hr />
 """
+_IMG_TMPL = "    <div><img src=\"{src}\" style=\"max-width: 100%; border: 1px solid #ddd;\" /></div>\n"
+_ERROR_TMPL = "    <pre>{error}</pre>\n"
+
+_STATUS_UPPER = {"passed": "PASSED", "failed": "FAILED", "skipped": "SKIPPED", "unknown": "UNKNOWN"}
+
+STORY_CACHE_DIR = Path("data/cache")
+
+# Only explicit "## Story ..." headings start a new story; other ## sections belong to the story above them
+_STORY_HEADING_RE = re.compile(r"^(?=##[ \t]+Story\b)", re.M | re.I)
+
+# Concurrent Bedrock generation calls for multi-story files; more only invites throttling
+_GENERATE_WORKERS = 4
+
+_status_lines: list[str] = []
+
+_CSV_HEADER = b"Timestamp,Test Cases,Results,Report,Archive\r\n"
+
+
+def _dumps_pretty(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+
+def _write_bytes_atomic(path: Path, data: bytes):
+    # Single write to a temp file, then rename so readers never see a partial file
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _dump(obj, path: Path):
+    _write_bytes_atomic(path, _dumps_pretty(obj))
+
+
+def _story_cache_path(prompt: str, model_id: str) -> Path:
+    # Keyed on the full prompt, so prompt template changes invalidate old entries too
+    key = hashlib.blake2b(f"{model_id}|{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+    return STORY_CACHE_DIR / f"{key}.json"
+
+
+def _tally(tests) -> tuple[int, int, int]:
+    passed = failed = 0
+    for t in tests:
+        status = t.get("status")
+        if status == "passed":
+            passed += 1
+        elif status == "failed":
+            failed += 1
+    return len(tests), passed, failed
+
+
+def write_html_report(results_json: dict, html_path: Path) -> tuple[int, int, int]:
+    tests = results_json.get("tests") or ()
+    total, passed, failed = _tally(tests)
+
+    # Stream section by section; the 1 MiB buffer still coalesces them into large writes
+    with open(html_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.write(_HTML_HEAD)
+        f.write(_SUMMARY_TMPL.format(total=total, passed=passed, failed=failed))
+        for tr in tests:
+            f.write(render_test_result(tr))
+        f.write(_HTML_TAIL)
+    return total, passed, failed
+
+
+def _encode_steps(test_result: dict) -> str:
+    return _dumps_pretty(test_result.get("steps", [])).decode("utf-8").translate(_ESC)
+
+
+def render_test_result(test_result: dict) -> str:
+    status = test_result.get("status") or "unknown"
+    screenshot = test_result.get("screenshot", "")
+    error = test_result.get("error", "")
+    return _SECTION_TMPL.format(
+        status_class="pass" if status == "passed" else "fail",
+        name=str(test_result.get("name", "Unnamed Test")).translate(_ESC),
+        status=_STATUS_UPPER.get(status) or status.upper(),
+        steps=_encode_steps(test_result),
+        img=_IMG_TMPL.format(src=urllib.parse.quote(screenshot)) if screenshot else "",
+        error=_ERROR_TMPL.format(error=str(error).translate(_ESC)) if error else "",
+    )
 
 
 def archive_files(zip_path: Path, files: list[Path]):
-    with zipfile.ZipFile(zip_path, "w") as zf:
+    # Artifacts are JSON/HTML text: fast deflate shrinks them several-fold for almost no CPU
+    with open(zip_path, "wb", buffering=1 << 20) as raw, \
+            zipfile.ZipFile(raw, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
         for f in files:
-            if f.exists():
+            try:
                 zf.write(f, arcname=f.name)
+            except FileNotFoundError:
+                continue
+
+
+def _csv_field(value) -> str:
+    text = str(value)
+    if any(c in text for c in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
 
 
 def log_to_csv(log_path: Path, timestamp: str, artifacts: dict):
-    csv_exists = log_path.exists()
-    with open(log_path, "a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        if not csv_exists:
-            writer.writerow(["Timestamp", "Test Cases", "Results", "Report", "Archive"])
-        writer.writerow([
-            timestamp,
-            str(artifacts.get("test_cases")),
-            str(artifacts.get("results")),
-            str(artifacts.get("report")),
-            str(artifacts.get("archive")),
-        ])
+    # Fixed five-column schema: format the row directly instead of going through csv.writer
+    row = ",".join(_csv_field(v) for v in (
+        timestamp,
+        artifacts.get("test_cases"),
+        artifacts.get("results"),
+        artifacts.get("report"),
+        artifacts.get("archive"),
+    ))
+    with open(log_path, "ab") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            f.write(_CSV_HEADER)
+        f.write((row + "\r\n").encode("utf-8"))
+
+
+def status(msg: str):
+    # Terminals see lines immediately; piped/CI output is coalesced into one write
+    if sys.stdout.isatty():
+        print(msg)
+    else:
+        _status_lines.append(msg + "\n")
+
+
+def flush_status():
+    if _status_lines:
+        sys.stdout.write("".join(_status_lines))
+        sys.stdout.flush()
+        _status_lines.clear()
 
 
 def read_story_text(args: argparse.Namespace) -> str:
@@ -92,6 +188,20 @@ def read_story_text(args: argparse.Namespace) -> str:
     raise SystemExit("You must provide --story or --story-file")
 
 
+def split_stories(story_text: str) -> list[str]:
+    """Split on "## Story" headings into unique stories, each prefixed with any text before the first one."""
+    preamble, *sections = _STORY_HEADING_RE.split(story_text)
+    if len(sections) < 2:
+        return [story_text]
+    preamble = preamble.strip()
+    stories = []
+    for section in sections:
+        story = f"{preamble}\n\n{section.strip()}" if preamble else section.strip()
+        if story not in stories:
+            stories.append(story)
+    return stories
+
+
 def main():
     parser = argparse.ArgumentParser(description="User Story → Test Cases → Runner")
     parser.add_argument("--base-url", required=True, help="Base URL under test")
@@ -103,8 +213,15 @@ def main():
     parser.add_argument("--headful", action="store_true", help="Run browser headful for debugging")
     parser.add_argument("--verbose", action="store_true", help="Print full prompts, responses, and step logs")
     parser.add_argument("--repair", action="store_true", help="Enable agent-in-the-loop selector repair on failures")
+    parser.add_argument("--concurrency", type=int, default=1, help="Run up to N tests at once, each lane in its own browser context (default: 1)")
+    parser.add_argument("--latency-optimized", action="store_true", help="Request Bedrock latency-optimized inference (supported models/regions only)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call Bedrock, ignoring cached test cases for this story")
 
     args = parser.parse_args()
+    atexit.register(flush_status)
+
+    # Deferred so --help stays fast; boto3 and Playwright are only loaded when needed
+    from story_agent import bedrock_client, build_prompt, generate_test_cases_from_story
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     run_dir = Path(f"data/runs/run_{timestamp}")
@@ -114,63 +231,113 @@ def main():
 
     story_text = read_story_text(args)
 
-    print("🧠 Generating test cases from user story...")
-    test_cases = generate_test_cases_from_story(
-        story_text=story_text,
-        base_url=args.base_url,
-        model_id=args.model_id,
-        region=args.region,
-        verbose=args.verbose,
-    )
+    stories = split_stories(story_text)
+
+    def generate(story: str) -> list:
+        # Unchanged prompt + model → reuse the previous Bedrock output
+        cache_path = _story_cache_path(build_prompt(story, args.base_url), args.model_id)
+        if not args.no_cache:
+            try:
+                cached = orjson.loads(cache_path.read_bytes())
+                status(f"→ Using cached test cases (pass --no-cache to regenerate): {cache_path}")
+                return cached
+            except (FileNotFoundError, ValueError):
+                pass
+        tests = generate_test_cases_from_story(
+            story_text=story,
+            base_url=args.base_url,
+            model_id=args.model_id,
+            region=args.region,
+            verbose=args.verbose,
+            latency_optimized=args.latency_optimized,
+        )
+        if tests:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_bytes_atomic(cache_path, _dumps_pretty(tests))
+        return tests
+
+    if len(stories) == 1:
+        status("🧠 Generating test cases from user story...")
+        test_cases = generate(stories[0])
+    else:
+        # Bedrock calls are network-bound, so a few threads overlap them
+        status(f"🧠 Generating test cases from {len(stories)} user stories...")
+        # Create the shared client before fanning out so the worker threads only ever use it
+        bedrock_client(args.region)
+        with ThreadPoolExecutor(max_workers=min(len(stories), _GENERATE_WORKERS)) as ex:
+            test_cases = [tc for batch in ex.map(generate, stories) for tc in batch]
 
     test_cases_path = run_dir / "test_cases.json"
-    with open(test_cases_path, "w", encoding="utf-8") as f:
-        json.dump(test_cases, f, indent=2)
-    print(f"📄 Test cases written: {test_cases_path}")
+    _dump(test_cases, test_cases_path)
+    status(f"📄 Test cases written: {test_cases_path}")
 
     artifacts = {"test_cases": test_cases_path}
 
     results_json = {"tests": []}
+    results_path = None
     if not args.dry_run:
-        print("🏃 Running tests with Playwright...")
-        results_json = asyncio.run(run_test_suite(
-            base_url=args.base_url,
-            test_cases=test_cases,
-            run_dir=run_dir,
-            headless=(not args.headful),
-            verbose=args.verbose,
-            model_id=args.model_id,
-            region=args.region,
-            repair=args.repair,
-        ))
+        import asyncio
+        from runner import run_test_suite, shutdown
+
+        run_loop = asyncio.run
+        if sys.platform != "win32":
+            try:
+                # uvloop.run (0.18+) replaces the deprecated uvloop.install()
+                from uvloop import run as run_loop
+            except ImportError:
+                pass
+
+        status("🏃 Running tests with Playwright...")
+        # The runner prints its own progress; emit ours first so the log stays in order
+        flush_status()
+
+        async def run_suite() -> dict:
+            try:
+                return await run_test_suite(
+                    base_url=args.base_url,
+                    test_cases=test_cases,
+                    run_dir=run_dir,
+                    headless=(not args.headful),
+                    verbose=args.verbose,
+                    model_id=args.model_id,
+                    region=args.region,
+                    repair=args.repair,
+                    latency_optimized=args.latency_optimized,
+                    concurrency=args.concurrency,
+                )
+            finally:
+                await shutdown()
 
+        results_json = run_loop(run_suite())
         results_path = run_dir / "results.json"
-        with open(results_path, "w", encoding="utf-8") as f:
-            json.dump(results_json, f, indent=2)
-        print(f"📊 Results written: {results_path}")
-        artifacts["results"] = results_path
 
     report_path = run_dir / "report.html"
-    write_html_report(results_json, report_path)
-    artifacts["report"] = report_path
-    print(f"📝 HTML report: {report_path}")
-
     archive_path = run_dir / "archive.zip"
-    archive_files(archive_path, [test_cases_path, report_path] + ([results_path] if not args.dry_run else []))
+
+    # results.json and report.html are independent; the archive needs both on disk
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        results_future = ex.submit(_dump, results_json, results_path) if results_path else None
+        report_future = ex.submit(write_html_report, results_json, report_path)
+        if results_future:
+            results_future.result()
+            status(f"📊 Results written: {results_path}")
+            artifacts["results"] = results_path
+        total, passed, failed = report_future.result()
+        artifacts["report"] = report_path
+        status(f"📝 HTML report: {report_path}")
+
+    archive_files(archive_path, [test_cases_path, report_path] + ([results_path] if results_path else []))
     artifacts["archive"] = archive_path
-    print(f"📦 Archive: {archive_path}")
+    status(f"📦 Archive: {archive_path}")
 
     csv_log_path = run_dir / "run_log.csv"
     log_to_csv(csv_log_path, timestamp, artifacts)
 
-    # Final console summary
-    total = len(results_json.get("tests", []))
-    passed = sum(1 for r in results_json.get("tests", []) if r.get("status") == "passed")
-    failed = sum(1 for r in results_json.get("tests", []) if r.get("status") == "failed")
+    # Final console summary (tally computed once while rendering the report)
     if total:
-        print(f"✅ Done. Total: {total}, Passed: {passed}, Failed: {failed}")
+        status(f"✅ Done. Total: {total}, Passed: {passed}, Failed: {failed}")
     else:
-        print("✅ Done. No tests executed (dry run or empty suite).")
+        status("✅ Done. No tests executed (dry run or empty suite).")
 
 
 if __name__ == "__main__":
@@ -1,13 +1,23 @@
 import asyncio
+import functools
 import json
+import logging
+import logging.handlers
 import os
 import re
+import sys
+import time
 import urllib.parse
 from pathlib import Path
 
+import orjson
 import pyotp
 from playwright.async_api import async_playwright
 
+from story_agent import bedrock_invoke_claude
+
+
+log = logging.getLogger(__name__)
 
 ALLOWED_AUTH_SUFFIXES = [
     "nih.gov",
@@ -16,59 +26,233 @@ ALLOWED_AUTH_SUFFIXES = [
     "login.gov",
     "identitysandbox.gov",
 ]
+_ALLOWED_AUTH_HOSTS = frozenset(ALLOWED_AUTH_SUFFIXES)
+_ALLOWED_AUTH_DOT_SUFFIXES = tuple("." + suf for suf in ALLOWED_AUTH_SUFFIXES)
+
+# Compiled once at import; these run on every auth step and probe
+_LOGIN_NAME_RE = re.compile(r"^(login|log\s*in|sign\s*in)$", re.I)
+_SOCIAL_TOKENS = frozenset({"facebook", "google", "github", "twitter", "apple", "orcid", "microsoft", "azure", "linkedin"})
+# Evaluated by Playwright's has_not_text filter in the page, not in Python
+_SOCIAL_RE = re.compile("|".join(sorted(_SOCIAL_TOKENS)), re.I)
+_LOGIN_GOV_RE = re.compile(r"login\.gov", re.I)
+_USERNAME_LABEL_RE = re.compile(r"(email|username)", re.I)
+_PASSWORD_LABEL_RE = re.compile(r"password", re.I)
+_CREDENTIALS_SUBMIT_RE = re.compile(r"^(sign\s*in|continue|submit)$", re.I)
+_OTP_LABEL_RE = re.compile(r"(one[- ]?time|verification|auth|otp).*code", re.I)
+_OTP_SUBMIT_RE = re.compile(r"^(submit|continue|verify|sign\s*in)$", re.I)
+_GRANT_RE = re.compile(r"\b(grant|authorize|allow|approve|consent|agree)\b", re.I)
+_CONSENT_PATTERNS = tuple(re.compile(p, re.I) for p in (r"continue", r"ok", r"accept", r"i\s*agree", r"proceed"))
+_USER_MENU_PATTERNS = tuple(re.compile(p, re.I) for p in (r"user", r"account", r"profile", r"menu", r"my\s*account", r"settings"))
+# Selectors that usually name an entry inside the user/account menu
+_MENU_ITEM_RE = re.compile(r"menuitem|sign[\s_-]*out|log[\s_-]*out|profile|my[\s_-]*account", re.I)
+# ...but not the control that opens that menu
+_MENU_TRIGGER_RE = re.compile(r"(user|account|profile)[\s_-]*menu|menu[\s_-]*(button|toggle|trigger)", re.I)
+
+# Selector normalizations in resolve_target; negated classes instead of lazy dots so misses fail fast
+_TEXT_BRACKET_RE = re.compile(r"""\[text="([^"]+)"\]|\[text='([^']+)'\]""")
+_DATA_TESTID_RE = re.compile(r"^data-testid\s*=\s*['\"]?([\w\-:]+)['\"]?$")
+_ROLE_EQ_RE = re.compile(r"^role\s*=\s*([\w-]+)$")
+_CSS_SIGNAL = frozenset("[].#: >")
+
+# Full-page captures as JPEG: much cheaper to encode than PNG deflate and far smaller on disk
+_SHOT_OPTS = {"type": "jpeg", "quality": 70}
+
+# JSON array inside a ``` or ```json fence in a model reply
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\[.*?\])\s*```", re.S)
+
+# How long a selector that missed every strategy is reported missing without re-probing
+_MISS_TTL_S = 2.0
+
+# Per-lane cap on (selector, URL path) resolutions kept for count() revalidation
+_PATH_MEMO_MAX = 256
+
+# New selector cache entries between intermediate writes of data/selector_cache.json
+_CACHE_FLUSH_EVERY = 25
+
+# What the first two login hops wait for instead of network idle: the Login.gov choice, then the credential form
+_LOGIN_GOV_READY = "a:has-text('Login.gov'), button:has-text('Login.gov'), input[type='email'], input[type='password']"
+_CREDENTIALS_READY = "input[type='email'], #email, #username, input[type='password']"
+
+# Chained after a union so .first is the first *visible* match, not a hidden one earlier in the DOM
+_VISIBLE = "visible=true"
+
+# One comma-OR'd query instead of ten per frame
+_GRANT_SELECTOR = ", ".join(
+    f"{tag}:has-text('{label}')"
+    for tag in ("button", "a")
+    for label in ("Grant", "Authorize", "Allow", "Approve", "Consent")
+)
+
+_CONSENT_LINK_INFO_JS = (
+    "el => ({"
+    "inDialog: !!el.closest('[role=dialog],[aria-modal=true],.modal,.cookie,.consent,.cookie-banner,.cc-window'),"
+    " href: el.getAttribute('href') || ''"
+    "})"
+)
+
+# href of the element or its enclosing link; null for buttons and other non-link targets
+_CLICK_HREF_JS = "el => { const a = el.closest('a[href]'); return a ? a.getAttribute('href') : null; }"
+
+
+@functools.lru_cache(maxsize=256)
+def _host(url: str) -> str:
+    """Lowercased hostname of url, or "" when it has none; pages and links repeat the same URLs."""
+    return urllib.parse.urlparse(url).hostname or ""
+
+
+@functools.lru_cache(maxsize=256)
+def _url_path(url: str) -> str:
+    """Path component of url, so one page's selectors survive query/fragment changes."""
+    return urllib.parse.urlparse(url).path
 
 
 def host_allowed(url: str, base_host: str) -> bool:
     try:
-        host = urllib.parse.urlparse(url).hostname or ""
+        host = _host(url)
     except Exception:
         return True
     if not host:
         return True
     if host == base_host or host.endswith("." + base_host):
         return True
-    return any(host == suf or host.endswith("." + suf) for suf in ALLOWED_AUTH_SUFFIXES)
+    return host in _ALLOWED_AUTH_HOSTS or host.endswith(_ALLOWED_AUTH_DOT_SUFFIXES)
+
+
+def _offsite_url_re(base_host: str) -> re.Pattern:
+    """Match http(s) URLs whose host is not base_host or an allowlisted auth domain (or a subdomain of either)."""
+    hosts = "|".join(re.escape(h) for h in (base_host, *ALLOWED_AUTH_SUFFIXES) if h)
+    return re.compile(rf"^https?://(?!(?:[^/?#@]*@)?(?:[^/?#:@]*\.)?(?:{hosts})(?::\d+)?(?:[/?#]|$))", re.I)
+
+
+# resolve_target's single-probe strategies as (applies, build) pairs: applies(selector) returns a
+# truthy hit (a regex match for string forms) and build(selector, hit) returns the engine target
+
+# Structured dict targets
+_DICT_STRATEGIES = (
+    (lambda s: "data-testid" in s, lambda s, _: {"engine": "testid", "value": s["data-testid"]}),
+    (lambda s: "role" in s and "name" in s, lambda s, _: {"engine": "role", "role": s["role"], "name_regex": re.escape(s["name"])}),
+    (lambda s: "text" in s, lambda s, _: {"engine": "text", "text": s["text"]}),
+    (lambda s: "css" in s, lambda s, _: {"engine": "css", "value": s["css"]}),
+)
+
+# String selectors
+_STR_STRATEGIES = (
+    # 1) Native Playwright test id engine "data-testid=" style
+    (_DATA_TESTID_RE.match, lambda s, m: {"engine": "testid", "value": m.group(1)}),
+    # 2) CSS as-is (handles [data-testid='...'] etc.)
+    (lambda s: not _CSS_SIGNAL.isdisjoint(s), lambda s, _: {"engine": "css", "value": s}),
+    # 3) text= engine
+    (lambda s: s.startswith("text="), lambda s, _: {"engine": "text", "text": s.split("=", 1)[1]}),
+    # 3b) role= engine (e.g., role=table)
+    (_ROLE_EQ_RE.match, lambda s, m: {"engine": "role", "role": m.group(1), "name_regex": ".*"}),
+)
+
+
+# Dict selector keys rendered in selector-engine notation for the repair prompt
+_REPAIR_FORMATTERS = {
+    "data-testid": lambda v, s: f"[data-testid='{v}']",
+    "role": lambda v, s: f"role={v}[name='{s.get('name') or s.get('value') or s.get('text') or ''}']",
+    "text": lambda v, s: f"text={v}",
+    "css": lambda v, s: str(v),
+}
+
+
+def selector_to_repair_string(selector) -> str:
+    """Describe a step selector for the repair prompt; dict selectors are rendered key by key."""
+    if not isinstance(selector, dict):
+        return str(selector)
+    parts = [fmt(v, selector) for k, v in selector.items() if (fmt := _REPAIR_FORMATTERS.get(k))]
+    return ", ".join(parts) if parts else json.dumps(selector, sort_keys=True)
+
+
+def _is_menu_selector(selector) -> bool:
+    """True when a step selector looks like it targets something inside the user menu."""
+    if not selector:
+        return False
+    text = selector_to_repair_string(selector)
+    return _MENU_ITEM_RE.search(text) is not None and _MENU_TRIGGER_RE.search(text) is None
+
+
+def _freeze(value):
+    """Hashable equivalent of a JSON-like value: dicts become sorted item tuples, lists become tuples."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def _name_pattern(name_regex: str) -> re.Pattern:
+    """Compiled, case-insensitive accessible-name pattern; shared across frames and steps."""
+    return re.compile(name_regex, re.I)
+
+
+_FN_STRIP_RE = re.compile(r"[^\w\s-]")
+_SLUG_SEP_RE = re.compile(r"[-_]+")
+_CAMEL_RE = re.compile(r"([a-z])([A-Z])")
+
+
+@functools.lru_cache(maxsize=2048)
+def sanitize_for_filename(name: str, default: str = "screenshot") -> str:
+    """Lowercase, underscore-separated file stem with path and shell punctuation removed."""
+    return "_".join(_FN_STRIP_RE.sub("", name).split()).lower() or default
+
+
+@functools.lru_cache(maxsize=256)
+def slug_to_text(slug: str) -> str:
+    """Humanize a slug: separators become spaces and camelCase is split."""
+    s = _SLUG_SEP_RE.sub(" ", slug)
+    s = _CAMEL_RE.sub(r"\1 \2", s)
+    return s.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _slug_css_candidates(slug: str) -> tuple[str, ...]:
+    """Alternate attribute selectors tried for a bare slug, built once per slug."""
+    return (
+        f"[data-testid='{slug}']",
+        f"[data-test-id='{slug}']",
+        f"[data-qa='{slug}']",
+        f"#{slug}",
+        f"[name='{slug}']",
+    )
 
 
 async def consent_dismiss(page, verbose: bool = False) -> None:
-    patterns = [r"continue", r"ok", r"accept", r"i\s*agree", r"proceed"]
-    for pat in patterns:
+    # Nothing here navigates before returning, so the host is stable across candidates
+    page_host = _host(page.url)
+    for pat in _CONSENT_PATTERNS:
         try:
-            btn = page.get_by_role("button", name=re.compile(pat, re.I)).first
+            btn = page.get_by_role("button", name=pat).first
             if await btn.is_visible():
                 if verbose:
-                    print(f"→ Dismissing consent button /{pat}/i")
+                    log.debug(f"→ Dismissing consent button /{pat.pattern}/i")
                 await btn.click(timeout=5000)
-                await page.wait_for_load_state("networkidle")
+                await wait_ready(page)
                 return
         except Exception:
             pass
         # Only click links if they are clearly inside a modal/dialog and same-origin/allowlisted
         try:
-            lnk = page.get_by_role("link", name=re.compile(pat, re.I)).first
+            lnk = page.get_by_role("link", name=pat).first
             if await lnk.is_visible():
-                # Must be inside a dialog-like container
-                in_dialog = False
-                try:
-                    in_dialog = await lnk.evaluate(
-                        "el => !!el.closest('[role=dialog],[aria-modal=true],.modal,.cookie,.consent,.cookie-banner,.cc-window')"
-                    )
-                except Exception:
-                    in_dialog = False
-                href = ""
+                # Must be inside a dialog-like container; read that and href in one round-trip
                 try:
-                    href = await lnk.get_attribute("href") or ""
+                    info = await lnk.evaluate(_CONSENT_LINK_INFO_JS)
                 except Exception:
-                    href = ""
+                    info = {}
+                in_dialog = bool(info.get("inDialog"))
+                href = info.get("href") or ""
                 same_or_allowed = True
                 if href:
-                    same_or_allowed = host_allowed(href, urllib.parse.urlparse(page.url).hostname or "")
+                    same_or_allowed = host_allowed(href, page_host)
                 if in_dialog and same_or_allowed:
                     if verbose:
                         dest = href or "(no href)"
-                        print(f"→ Dismissing consent link /{pat}/i inside dialog to {dest}")
+                        log.debug(f"→ Dismissing consent link /{pat.pattern}/i inside dialog to {dest}")
                     await lnk.click(timeout=5000)
-                    await page.wait_for_load_state("networkidle")
+                    await wait_ready(page)
                     return
         except Exception:
             pass
@@ -77,58 +261,51 @@ async def consent_dismiss(page, verbose: bool = False) -> None:
 async def click_login_button(page, verbose: bool = False) -> None:
     # Prefer explicit test id
     try:
-        await page.wait_for_selector("[data-testid='login-button']", state="visible", timeout=6000)
+        # click() auto-waits for visibility, so no separate wait_for_selector round-trip
         await page.click("[data-testid='login-button']", timeout=6000)
         if verbose:
-            print("✓ Clicked [data-testid='login-button']")
+            log.debug("✓ Clicked [data-testid='login-button']")
         return
     except Exception:
         pass
 
-    # Fallback: role and text, avoid social providers
-    disallow = re.compile(r"facebook|google|github|twitter|apple|orcid|microsoft|azure|linkedin", re.I)
-    for role in ("button", "link"):
-        try:
-            # Match variations but exclude social providers and external links
-            loc = page.get_by_role(role, name=re.compile(r"^(login|log\s*in|sign\s*in)$", re.I)).first
-            if await loc.is_visible():
-                name = (await loc.inner_text()) or ""
-                if disallow.search(name):
-                    raise Exception("Filtered social provider control")
-                # If it's a link, ensure it's same-origin or allowlisted
-                if role == "link":
-                    href = await loc.get_attribute("href") or ""
-                    if href and not host_allowed(href, urllib.parse.urlparse(page.url).hostname or ""):
-                        raise Exception("Filtered external login link")
-                if verbose:
-                    print(f"→ Clicking {role} exact name Login/Sign in")
-                await loc.click(timeout=6000)
-                await page.wait_for_load_state("networkidle")
-                return
-        except Exception:
-            pass
+    # Fallback: button or link by name in one query, avoid social providers
+    try:
+        # Match variations but exclude social providers and external links
+        loc = (
+            page.get_by_role("button", name=_LOGIN_NAME_RE)
+            .or_(page.get_by_role("link", name=_LOGIN_NAME_RE))
+            .filter(has_not_text=_SOCIAL_RE)
+            .locator(_VISIBLE)
+            .first
+        )
+        # get_attribute waits for a visible match, standing in for a separate visibility probe;
+        # buttons carry no href, links must be same-origin or allowlisted
+        href = await loc.get_attribute("href", timeout=3000) or ""
+        if href and not host_allowed(href, _host(page.url)):
+            raise Exception("Filtered external login link")
+        if verbose:
+            log.debug("→ Clicking button/link exact name Login/Sign in")
+        await loc.click(timeout=6000)
+        await wait_ready(page, timeout=10000, ready_sel=_LOGIN_GOV_READY)
+        return
+    except Exception:
+        pass
     raise AssertionError("Login button not found")
 
 
 async def login_button_visible(page) -> bool:
     """Return True if a Login/Log in/Sign in control is visible on the current page."""
-    # Prefer explicit test id
+    # Explicit test id or role/button pattern, checked in one query
     try:
-        el = await page.query_selector("[data-testid='login-button']")
-        if el and await el.is_visible():
-            return True
-    except Exception:
-        pass
-    # Role/button patterns
-    try:
-        loc = page.get_by_role("button", name=re.compile(r"^(login|log\s*in|sign\s*in)$", re.I)).first
+        loc = page.locator("[data-testid='login-button']").or_(page.get_by_role("button", name=_LOGIN_NAME_RE)).locator(_VISIBLE).first
         if await loc.is_visible():
             return True
     except Exception:
         pass
     # Text-based fallback
     try:
-        loc = page.get_by_text(re.compile(r"^(login|log\s*in|sign\s*in)$", re.I), exact=False).first
+        loc = page.get_by_text(_LOGIN_NAME_RE, exact=False).first
         if await loc.is_visible():
             return True
     except Exception:
@@ -137,23 +314,22 @@ async def login_button_visible(page) -> bool:
 
 
 async def click_login_gov(page, verbose: bool = False) -> None:
-    for role in ("button", "link"):
-        try:
-            loc = page.get_by_role(role, name=re.compile(r"login\.gov", re.I)).first
-            if await loc.is_visible():
-                if verbose:
-                    print(f"→ Clicking {role} Login.gov")
-                await loc.click(timeout=6000)
-                await page.wait_for_load_state("networkidle")
-                return
-        except Exception:
-            pass
+    try:
+        loc = page.get_by_role("button", name=_LOGIN_GOV_RE).or_(page.get_by_role("link", name=_LOGIN_GOV_RE)).locator(_VISIBLE).first
+        # Let click() auto-wait; a short timeout leaves time for the text fallback
+        await loc.click(timeout=3000)
+        await wait_ready(page, timeout=10000, ready_sel=_CREDENTIALS_READY)
+        if verbose:
+            log.debug("→ Clicked button/link Login.gov")
+        return
+    except Exception:
+        pass
     # Fallback text selector
     try:
         await page.get_by_text("Login.gov", exact=False).first.click(timeout=6000)
-        await page.wait_for_load_state("networkidle")
+        await wait_ready(page, timeout=10000, ready_sel=_CREDENTIALS_READY)
         if verbose:
-            print("→ Clicked Login.gov via text")
+            log.debug("→ Clicked Login.gov via text")
         return
     except Exception:
         pass
@@ -163,9 +339,9 @@ async def click_login_gov(page, verbose: bool = False) -> None:
 async def fill_credentials_and_submit(page, username: str, password: str, verbose: bool = False) -> None:
     # Prefer labels first (works on login.gov)
     try:
-        await page.get_by_label(re.compile(r"(email|username)", re.I)).first.fill(username, timeout=8000)
+        await page.get_by_label(_USERNAME_LABEL_RE).first.fill(username, timeout=8000)
         if verbose:
-            print("→ Filled username by label")
+            log.debug("→ Filled username by label")
     except Exception:
         # Fallback common selectors
         for sel in [
@@ -178,7 +354,7 @@ async def fill_credentials_and_submit(page, username: str, password: str, verbos
             try:
                 await page.fill(sel, username, timeout=5000)
                 if verbose:
-                    print(f"→ Filled username via {sel}")
+                    log.debug(f"→ Filled username via {sel}")
                 break
             except Exception:
                 continue
@@ -186,9 +362,9 @@ async def fill_credentials_and_submit(page, username: str, password: str, verbos
             raise AssertionError("Unable to fill username/email")
 
     try:
-        await page.get_by_label(re.compile(r"password", re.I)).first.fill(password, timeout=8000)
+        await page.get_by_label(_PASSWORD_LABEL_RE).first.fill(password, timeout=8000)
         if verbose:
-            print("→ Filled password by label")
+            log.debug("→ Filled password by label")
     except Exception:
         for sel in [
             "input[type='password']",
@@ -198,7 +374,7 @@ async def fill_credentials_and_submit(page, username: str, password: str, verbos
             try:
                 await page.fill(sel, password, timeout=5000)
                 if verbose:
-                    print(f"→ Filled password via {sel}")
+                    log.debug(f"→ Filled password via {sel}")
                 break
             except Exception:
                 continue
@@ -208,36 +384,70 @@ async def fill_credentials_and_submit(page, username: str, password: str, verbos
     # Submit
     for role in ("button",):
         try:
-            loc = page.get_by_role(role, name=re.compile(r"^(sign\s*in|continue|submit)$", re.I)).first
+            loc = page.get_by_role(role, name=_CREDENTIALS_SUBMIT_RE).first
             if await loc.is_visible():
                 await loc.click(timeout=6000)
-                await page.wait_for_load_state("networkidle")
+                await wait_ready(page)
                 if verbose:
-                    print("→ Clicked Sign in")
+                    log.debug("→ Clicked Sign in")
                 return
         except Exception:
             pass
     for sel in ["button[type='submit']", "#submit"]:
         try:
             await page.click(sel, timeout=6000)
-            await page.wait_for_load_state("networkidle")
+            await wait_ready(page)
             if verbose:
-                print(f"→ Clicked submit via {sel}")
+                log.debug(f"→ Clicked submit via {sel}")
             return
         except Exception:
             continue
     raise AssertionError("Unable to submit credentials")
 
 
+@functools.lru_cache(maxsize=None)
+def _totp_for(secret: str) -> pyotp.TOTP:
+    """One TOTP per secret, so the base32 secret is decoded once per process."""
+    return pyotp.TOTP(secret)
+
+
+async def save_screenshot(page, path: Path) -> str:
+    """Capture a full-page screenshot and write it to path off the event loop."""
+    data = await page.screenshot(full_page=True, **_SHOT_OPTS)
+    await asyncio.to_thread(path.write_bytes, data)
+    return str(path)
+
+
+async def wait_ready(page, idle_ms: float = 2000, timeout: float = 30000, ready_sel: str | None = None) -> None:
+    """Wait for DOMContentLoaded, then for ready_sel to show or, without one, at most idle_ms of network quiet."""
+    await page.wait_for_load_state("domcontentloaded", timeout=timeout)
+    try:
+        if ready_sel:
+            await page.wait_for_selector(ready_sel, state="visible", timeout=timeout)
+        else:
+            # Long-polling and analytics beacons can keep a page from ever reaching networkidle
+            await page.wait_for_load_state("networkidle", timeout=idle_ms)
+    except Exception:
+        pass
+
+
+def _seconds_to_next_window(totp: pyotp.TOTP) -> float:
+    """Time until the next TOTP code is issued, plus a small margin for clock skew."""
+    return max(0.5, totp.interval - time.time() % totp.interval + 0.2)
+
+
 async def handle_otp_and_consent(page, totp_secret: str, base_host: str, verbose: bool = False) -> None:
+    totp = _totp_for(totp_secret)
     for attempt in range(2):
-        code = pyotp.TOTP(totp_secret).now()
+        # Pin the timestamp so the logged window is the one the code was generated for
+        now = int(time.time())
+        code = totp.at(now)
         if verbose:
-            print(f"→ OTP attempt {attempt+1}, code={code}")
+            log.debug(f"→ OTP attempt {attempt+1}, code={code}, window={now // totp.interval}")
 
         # Fill OTP by label or common selectors
         try:
-            await page.get_by_label(re.compile(r"(one[- ]?time|verification|auth|otp).*code", re.I)).first.fill(code, timeout=8000)
+            await page.get_by_label(_OTP_LABEL_RE).first.fill(code, timeout=8000)
         except Exception:
             filled = False
             for sel in ["#otp", "input[name*='otp']", "input[id*='otp']", "input[name*='code']", "input[id*='code']"]:
@@ -250,12 +460,13 @@ async def handle_otp_and_consent(page, totp_secret: str, base_host: str, verbose
             if not filled:
                 if attempt == 1:
                     raise AssertionError("Unable to fill OTP code")
-                await page.wait_for_timeout(30000)
+                # A retry only helps once a fresh code is issued
+                await asyncio.sleep(_seconds_to_next_window(totp))
                 continue
 
         # Submit OTP
         try:
-            await page.get_by_role("button", name=re.compile(r"^(submit|continue|verify|sign\s*in)$", re.I)).first.click(timeout=6000)
+            await page.get_by_role("button", name=_OTP_SUBMIT_RE).first.click(timeout=6000)
         except Exception:
             for sel in ["button[type='submit']", "#submit"]:
                 try:
@@ -265,555 +476,752 @@ async def handle_otp_and_consent(page, totp_secret: str, base_host: str, verbose
                     continue
 
         # Consent grant if shown (search across frames, multiple labels)
-        grant_labels = re.compile(r"\b(grant|authorize|allow|approve|consent|agree)\b", re.I)
-        async def try_click_grant_anywhere() -> bool:
-            # Frames to search: main frame + all child frames
-            frames = []
+        def grant_candidates(fr):
+            # Role/button/link by accessible name, then generic selectors
+            yield fr.get_by_role("button", name=_GRANT_RE).or_(fr.get_by_role("link", name=_GRANT_RE)).locator(_VISIBLE).first
+            yield fr.locator(_GRANT_SELECTOR).locator(_VISIBLE).first
+
+        async def becomes_visible(loc, timeout_ms: float) -> bool:
+            try:
+                await loc.wait_for(state="visible", timeout=timeout_ms)
+                return True
+            except Exception:
+                return False
+
+        async def next_frame_attached(timeout_ms: float) -> None:
             try:
-                mainf = page.main_frame
-                if mainf:
-                    frames.append(mainf)
+                await page.wait_for_event("frameattached", timeout=timeout_ms)
             except Exception:
                 pass
-            for fr in page.frames:
-                if fr not in frames:
-                    frames.append(fr)
-            # Try role=button/link by accessible name
-            for fr in frames:
-                try:
-                    loc = fr.get_by_role("button", name=grant_labels).first
-                    if await loc.is_visible():
-                        if verbose:
-                            print(f"→ Clicking consent button in frame {fr.url}")
-                        await loc.click(timeout=6000)
-                        await fr.wait_for_load_state("networkidle")
-                        return True
-                except Exception:
-                    pass
-                try:
-                    loc = fr.get_by_role("link", name=grant_labels).first
-                    if await loc.is_visible():
-                        if verbose:
-                            print(f"→ Clicking consent link in frame {fr.url}")
-                        await loc.click(timeout=6000)
-                        await fr.wait_for_load_state("networkidle")
-                        return True
-                except Exception:
-                    pass
-                # Try generic selectors
-                for sel in [
-                    "button:has-text('Grant')",
-                    "button:has-text('Authorize')",
-                    "button:has-text('Allow')",
-                    "button:has-text('Approve')",
-                    "button:has-text('Consent')",
-                    "a:has-text('Grant')",
-                    "a:has-text('Authorize')",
-                    "a:has-text('Allow')",
-                    "a:has-text('Approve')",
-                    "a:has-text('Consent')",
-                ]:
-                    try:
-                        el = await fr.query_selector(sel)
-                        if el and await el.is_visible():
+
+        async def click_grant_when_visible(timeout_ms: float) -> bool:
+            """Wait for a consent control to appear in any frame (including late iframes) and click it."""
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout_ms / 1000
+            watched = set()
+            owners = {}
+            frame_added = None
+            try:
+                while True:
+                    remaining_ms = (deadline - loop.time()) * 1000
+                    if remaining_ms <= 0:
+                        return False
+                    # page.frames already lists the main frame first, then child frames
+                    for fr in page.frames:
+                        if fr in watched:
+                            continue
+                        watched.add(fr)
+                        for loc in grant_candidates(fr):
+                            owners[asyncio.create_task(becomes_visible(loc, remaining_ms))] = (fr, loc)
+                    if frame_added is None or frame_added.done():
+                        frame_added = asyncio.create_task(next_frame_attached(remaining_ms))
+                    done, _ = await asyncio.wait(
+                        [t for t in owners if not t.done()] + [frame_added],
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    for task in done:
+                        if task is frame_added or not task.result():
+                            owners.pop(task, None)
+                            continue
+                        fr, loc = owners.pop(task)
+                        try:
                             if verbose:
-                                print(f"→ Clicking consent via selector in frame {fr.url}: {sel}")
-                            await el.click(timeout=6000)
-                            await fr.wait_for_load_state("networkidle")
+                                log.debug(f"→ Clicking consent control in frame {fr.url}")
+                            await loc.click(timeout=6000)
+                            await wait_ready(fr)
                             return True
-                    except Exception:
-                        continue
-            return False
+                        except Exception:
+                            continue
+            finally:
+                for task in [*owners, frame_added]:
+                    if task is not None:
+                        task.cancel()
 
         # Try to click grant for up to ~8 seconds
-        end_grant = page.context._impl_obj._loop.time() + 8
-        while page.context._impl_obj._loop.time() < end_grant:
-            if await try_click_grant_anywhere():
-                return
-            await page.wait_for_timeout(250)
+        if await click_grant_when_visible(8000):
+            return
 
         # Or success by redirect back to hub
-        end = page.context._impl_obj._loop.time() + 10
-        while page.context._impl_obj._loop.time() < end:
-            if (urllib.parse.urlparse(page.url).hostname or "").endswith(base_host):
-                return
-            await page.wait_for_timeout(250)
+        try:
+            await page.wait_for_url(
+                lambda u: _host(u).endswith(base_host),
+                wait_until="commit",
+                timeout=10000,
+            )
+            return
+        except Exception:
+            pass
 
-        await page.wait_for_timeout(30000)
+        await asyncio.sleep(_seconds_to_next_window(totp))
 
     raise AssertionError("OTP failed after 2 attempts")
 
 
-async def run_test_suite(base_url: str, test_cases: list[dict], run_dir: Path, headless: bool = True, verbose: bool = False, model_id: str | None = None, region: str | None = None, repair: bool = False) -> dict:
-    screenshots_dir = run_dir / "screenshots"
-    screenshots_dir.mkdir(parents=True, exist_ok=True)
+def _attach_console(verbose: bool) -> logging.Handler:
+    """Send run output to stdout: line by line on a terminal, batched when piped (warnings flush at once)."""
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    if sys.stdout.isatty():
+        handler = stream
+    else:
+        handler = logging.handlers.MemoryHandler(256, flushLevel=logging.WARNING, target=stream)
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log.propagate = False
+    return handler
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=headless)
-        context = await browser.new_context(viewport={"width": 1366, "height": 900})
-        page = await context.new_page()
 
-        base_host = urllib.parse.urlparse(base_url).hostname or ""
+# Playwright driver and browser, started on first use and reused by later runs in the same event loop
+_pw = None
+_browser = None
+_browser_headless = None
+_browser_loop = None
+_browser_lock = None
 
-        # Block disallowed domains
-        async def route_guard(route, request):
+
+async def _get_browser(headless: bool):
+    global _pw, _browser, _browser_headless, _browser_loop, _browser_lock
+    loop = asyncio.get_running_loop()
+    if _browser_loop is not loop:
+        # Playwright objects are bound to the loop that created them
+        _pw = _browser = _browser_headless = None
+        _browser_loop = loop
+        _browser_lock = asyncio.Lock()
+    async with _browser_lock:
+        if _browser is not None and (_browser_headless != headless or not _browser.is_connected()):
             try:
-                if request.resource_type == "document" and request.is_navigation_request():
-                    if not host_allowed(request.url, base_host):
-                        if verbose:
-                            print(f"⛔ Blocking navigation: {request.url}")
-                        await route.abort()
-                        return
+                await _browser.close()
             except Exception:
                 pass
-            await route.continue_()
+            _browser = None
+        if _pw is None:
+            _pw = await async_playwright().start()
+        if _browser is None:
+            _browser = await _pw.chromium.launch(headless=headless)
+            _browser_headless = headless
+        return _browser
 
-        await context.route("**/*", route_guard)
 
-        # Close any disallowed popups
-        async def on_popup(popup_page):
-            try:
-                await popup_page.wait_for_load_state("domcontentloaded", timeout=5000)
-            except Exception:
-                pass
-            if not host_allowed(popup_page.url, base_host):
-                if verbose:
-                    print(f"⛔ Closing popup: {popup_page.url}")
-                await popup_page.close()
+async def shutdown() -> None:
+    """Close the shared browser and stop Playwright; call once before the event loop exits."""
+    global _pw, _browser, _browser_headless, _browser_loop
+    if _browser is not None:
+        try:
+            await _browser.close()
+        except Exception:
+            pass
+    if _pw is not None:
+        try:
+            await _pw.stop()
+        except Exception:
+            pass
+    _pw = _browser = _browser_headless = _browser_loop = None
 
-        page.on("popup", lambda p: asyncio.create_task(on_popup(p)))
 
-        results = []
-        session_logged_in = False
+async def run_test_suite(base_url: str, test_cases: list[dict], run_dir: Path, headless: bool = True, verbose: bool = False, model_id: str | None = None, region: str | None = None, repair: bool = False, latency_optimized: bool = False, concurrency: int = 1) -> dict:
+    screenshots_dir = run_dir / "screenshots"
+    screenshots_dir.mkdir(parents=True, exist_ok=True)
+
+    console = _attach_console(verbose)
+    try:
+        # The browser is shared across runs; each lane gets its own context and closes only that
+        browser = await _get_browser(headless)
+        base_host = _host(base_url)
 
         # Simple selector cache (persists across runs)
         cache_path = Path("data/selector_cache.json")
         try:
             if cache_path.exists():
-                selector_cache = json.loads(cache_path.read_text(encoding="utf-8"))
+                selector_cache = orjson.loads(cache_path.read_bytes())
             else:
                 selector_cache = {}
         except Exception:
             selector_cache = {}
 
+        cache_key_text = {}
+
         def cache_get(key: str):
             return selector_cache.get(key)
 
-        def cache_put(key: str, value: dict):
-            selector_cache[key] = value
+        # Writes are batched: puts mark the cache dirty, every _CACHE_FLUSH_EVERY new entries are written
+        # out in case the run dies, and whatever is left is flushed once the lanes finish
+        cache_dirty = False
+        cache_unflushed = 0
+        cache_written_hash = None
+
+        def flush_cache():
+            nonlocal cache_dirty, cache_unflushed, cache_written_hash
+            if not cache_dirty:
+                return
+            cache_dirty = False
+            cache_unflushed = 0
+            data = orjson.dumps(selector_cache)
+            if hash(data) == cache_written_hash:
+                return
             try:
                 cache_path.parent.mkdir(parents=True, exist_ok=True)
-                cache_path.write_text(json.dumps(selector_cache, indent=2), encoding="utf-8")
+                tmp = cache_path.with_name(cache_path.name + ".tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, cache_path)
+                cache_written_hash = hash(data)
             except Exception:
                 pass
 
-        async def open_user_menu_if_needed():
-            # Try common triggers for a user/account menu
-            patterns = [r"user", r"account", r"profile", r"menu", r"my\s*account", r"settings"]
-            for pat in patterns:
-                try:
-                    loc = page.get_by_role("button", name=re.compile(pat, re.I)).first
-                    if await loc.is_visible():
-                        await loc.click(timeout=4000)
-                        await page.wait_for_load_state("networkidle")
-                        return True
-                except Exception:
-                    continue
-            # Test ID variants
-            for sel in [
-                "[data-testid*='user']",
-                "[data-testid*='account']",
-                "#userMenu",
-                ".user-menu",
-            ]:
-                try:
-                    el = await page.query_selector(sel)
-                    if el and await el.is_visible():
-                        await el.click(timeout=4000)
-                        await page.wait_for_load_state("networkidle")
-                        return True
-                except Exception:
-                    continue
-            return False
+        def cache_put(key: str, value: dict):
+            nonlocal cache_dirty, cache_unflushed
+            if selector_cache.get(key) == value:
+                return
+            selector_cache[key] = value
+            cache_dirty = True
+            cache_unflushed += 1
+            if cache_unflushed >= _CACHE_FLUSH_EVERY:
+                flush_cache()
 
-        async def is_logged_in() -> bool:
-            if session_logged_in:
-                return True
-            # If we haven't navigated yet, we are not logged in
-            try:
-                cur = page.url
-                if not cur or cur.startswith("about:"):
-                    return False
-            except Exception:
-                return False
-            # If a Login control is visible, we are not logged in
-            try:
-                loc = page.get_by_role("button", name=re.compile(r"^(login|log\s*in|sign\s*in)$", re.I)).first
-                if await loc.is_visible():
-                    return False
-            except Exception:
-                pass
-            try:
-                el = await page.query_selector("[data-testid='login-button']")
-                if el and await el.is_visible():
-                    return False
-            except Exception:
-                pass
-            # Positive signals for logged-in
+        # Lanes log in one at a time: the first full Login.gov login publishes its cookies for the others,
+        # and a lane that still has to log in waits for a TOTP window no earlier login has used
+        login_lock = asyncio.Lock()
+        shared_session = None
+        last_login_window = None
+
+        async def run_lane(lane: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+            """Run tests in order in one fresh context (its own cookies, so its own login); return (index, result) pairs."""
+            context = await browser.new_context(viewport={"width": 1366, "height": 900})
             try:
-                el = await page.query_selector("[data-testid='user-menu']")
-                if el and await el.is_visible():
-                    return True
-            except Exception:
-                pass
-            for pat in (r"user", r"account", r"profile"):
-                try:
-                    loc = page.get_by_role("button", name=re.compile(pat, re.I)).first
-                    if await loc.is_visible():
-                        return True
-                except Exception:
-                    continue
-            # Default to True to avoid re-login loops when login controls are absent
-            return True
+                page = await context.new_page()
 
-        async def find_locator_any_frame(target: dict):
-            """Return (frame, locator) for first visible match, else (None, None).
-            target keys accepted:
-              - engine: 'testid'|'css'|'text'|'role'
-              - value/text/role/name_regex
-            """
-            frames = list({page.main_frame, *page.frames})
-            for fr in frames:
-                try:
-                    engine = target.get("engine")
-                    if engine == "testid":
-                        loc = fr.get_by_test_id(target["value"]).first
-                    elif engine == "css":
-                        loc = fr.locator(target["value"])  # css selector
-                    elif engine == "text":
-                        loc = fr.get_by_text(target["text"], exact=False).first
-                    elif engine == "role":
-                        name_pattern = re.compile(target["name_regex"], re.I)
-                        loc = fr.get_by_role(target["role"], name=name_pattern).first
-                    else:
-                        continue
+                # Block disallowed domains
+                async def route_guard(route, request):
                     try:
-                        if await loc.is_visible():
-                            return fr, loc
+                        if request.resource_type == "document" and request.is_navigation_request():
+                            if not host_allowed(request.url, base_host):
+                                if verbose:
+                                    log.debug(f"⛔ Blocking navigation: {request.url}")
+                                await route.abort()
+                                return
                     except Exception:
                         pass
-                    # If not visible, still return if it exists; caller can try clicking/opening
+                    await route.continue_()
+
+                # Only URLs off the allowlist are intercepted; the regex is matched browser-side,
+                # so same-site and auth-provider traffic never round-trips through Python
+                await context.route(_offsite_url_re(base_host), route_guard)
+
+                # Close any disallowed popups
+                async def on_popup(popup_page):
                     try:
-                        cnt = await loc.count()
-                        if cnt and cnt > 0:
-                            return fr, loc
+                        await popup_page.wait_for_load_state("domcontentloaded", timeout=5000)
                     except Exception:
                         pass
-                except Exception:
-                    continue
-            return None, None
-
-        def slug_to_text(slug: str) -> str:
-            s = re.sub(r"[-_]+", " ", slug)
-            s = re.sub(r"([a-z])([A-Z])", r"\1 \2", s)
-            return s.strip()
-
-        async def resolve_target(selector: str, hints: dict | None = None):
-            """Return (frame, locator, used_key) using cache and multi-strategy resolution."""
-            # Build a stable cache key for strings or dicts
-            if isinstance(selector, dict):
-                cache_key = json.dumps({"target": selector, "hints": hints or {}}, sort_keys=True)
-            else:
-                cache_key = selector
-            if hints:
-                # include role/text hints in key to separate entries
-                cache_key = json.dumps({"selector": selector if isinstance(selector, str) else selector, "hints": hints}, sort_keys=True)
-
-            # Normalizations
-            if isinstance(selector, str) and selector and "[text=" in selector:
-                # Convert [text='...'] into text=...
-                m = re.search(r"\[text=['\"](.+?)['\"]\]", selector)
-                if m:
-                    selector = f"text={m.group(1)}"
-
-            cached = cache_get(cache_key)
-            if cached:
-                fr, loc = await find_locator_any_frame(cached)
-                if fr:
-                    return fr, loc, cache_key
+                    if not host_allowed(popup_page.url, base_host):
+                        if verbose:
+                            log.debug(f"⛔ Closing popup: {popup_page.url}")
+                        await popup_page.close()
 
-            # Structured dict target
-            if isinstance(selector, dict):
-                if "data-testid" in selector:
-                    fr, loc = await find_locator_any_frame({"engine": "testid", "value": selector["data-testid"]})
-                    if fr:
-                        cache_put(cache_key, {"engine": "testid", "value": selector["data-testid"]})
-                        return fr, loc, cache_key
-                if "role" in selector and "name" in selector:
-                    fr, loc = await find_locator_any_frame({"engine": "role", "role": selector["role"], "name_regex": re.escape(selector["name"])})
-                    if fr:
-                        cache_put(cache_key, {"engine": "role", "role": selector["role"], "name_regex": re.escape(selector["name"])})
-                        return fr, loc, cache_key
-                if "text" in selector:
-                    fr, loc = await find_locator_any_frame({"engine": "text", "text": selector["text"]})
-                    if fr:
-                        cache_put(cache_key, {"engine": "text", "text": selector["text"]})
-                        return fr, loc, cache_key
-                if "css" in selector:
-                    fr, loc = await find_locator_any_frame({"engine": "css", "value": selector["css"]})
+                page.on("popup", lambda p: asyncio.create_task(on_popup(p)))
+
+                # Main-frame host, refreshed on navigation rather than reparsed per check; the generation
+                # counts navigations and our own clicks so cached misses expire when the page changes
+                page_host = ""
+                page_generation = 0
+
+                def on_frame_navigated(frame):
+                    nonlocal page_host, page_generation
+                    page_generation += 1
+                    if frame == page.main_frame:
+                        page_host = _host(frame.url)
+
+                page.on("framenavigated", on_frame_navigated)
+
+                results = []
+                session_logged_in = False
+
+                # Keyed by (cache_key, url, page_generation): resolved (frame, locator) pairs, and the
+                # monotonic time of full misses; only the current generation is kept
+                resolved_on_page = {}
+                miss_cache = {}
+                cached_generation = 0
+                # Keyed by (cache_key, url path): last resolution on that route, re-checked with count()
+                # once the page has changed; least recently used entries beyond _PATH_MEMO_MAX are dropped
+                resolved_on_path = {}
+
+                def forget_stale_pages():
+                    """Drop per-page entries (and their frame/locator references) once the page has changed."""
+                    nonlocal cached_generation
+                    if cached_generation != page_generation:
+                        resolved_on_page.clear()
+                        miss_cache.clear()
+                        cached_generation = page_generation
+
+                def remember_on_path(path_state, found):
+                    resolved_on_path.pop(path_state, None)
+                    resolved_on_path[path_state] = found
+                    if len(resolved_on_path) > _PATH_MEMO_MAX:
+                        del resolved_on_path[next(iter(resolved_on_path))]
+
+                async def open_user_menu_if_needed():
+                    nonlocal page_generation
+                    # Try common triggers for a user/account menu
+                    for pat in _USER_MENU_PATTERNS:
+                        try:
+                            loc = page.get_by_role("button", name=pat).first
+                            if await loc.is_visible():
+                                await loc.click(timeout=4000)
+                                page_generation += 1
+                                await wait_ready(page)
+                                return True
+                        except Exception:
+                            continue
+                    # Test ID variants
+                    for sel in [
+                        "[data-testid*='user']",
+                        "[data-testid*='account']",
+                        "#userMenu",
+                        ".user-menu",
+                    ]:
+                        try:
+                            el = await page.query_selector(sel)
+                            if el and await el.is_visible():
+                                await el.click(timeout=4000)
+                                page_generation += 1
+                                await wait_ready(page)
+                                return True
+                        except Exception:
+                            continue
+                    return False
+
+                menu_opened_this_test = False
+
+                async def open_user_menu_for(selector, loc):
+                    """Open the user menu, once per test, when a menu-entry selector resolved to a hidden element."""
+                    nonlocal menu_opened_this_test
+                    if menu_opened_this_test or not _is_menu_selector(selector):
+                        return
+                    try:
+                        if await loc.is_visible():
+                            return
+                    except Exception:
+                        pass
+                    menu_opened_this_test = True
+                    await open_user_menu_if_needed()
+
+                async def find_locator_any_frame(target: dict):
+                    """Return (frame, locator) for the first frame with a match, else (None, None).
+                    target keys accepted:
+                      - engine: 'testid'|'css'|'text'|'role'
+                      - value/text/role/name_regex
+                    """
+                    engine = target.get("engine")
+                    candidates = []
+                    # page.frames already includes the main frame (first); no need to merge and dedupe
+                    for fr in page.frames:
+                        try:
+                            if engine == "testid":
+                                loc = fr.get_by_test_id(target["value"]).first
+                            elif engine == "css":
+                                loc = fr.locator(target["value"])  # css selector
+                            elif engine == "text":
+                                loc = fr.get_by_text(target["text"], exact=False).first
+                            elif engine == "role":
+                                loc = fr.get_by_role(target["role"], name=_name_pattern(target["name_regex"])).first
+                            else:
+                                return None, None
+                        except Exception:
+                            continue
+                        candidates.append((fr, loc))
+                    # Visible or not, an existing match is returned (callers wait/click/open menus themselves),
+                    # so a single count() decides it; all frames are counted at once and the first in frame order wins
+                    counts = await asyncio.gather(*(loc.count() for _, loc in candidates), return_exceptions=True)
+                    for (fr, loc), n in zip(candidates, counts):
+                        if not isinstance(n, BaseException) and n:
+                            return fr, loc
+                    return None, None
+
+                async def find_first_any_frame(targets: list[dict]):
+                    """Probe targets concurrently; return (frame, locator, target) for the earliest one in list order that matched."""
+                    found = await asyncio.gather(*(find_locator_any_frame(t) for t in targets))
+                    for target, (fr, loc) in zip(targets, found):
+                        if fr:
+                            return fr, loc, target
+                    return None, None, None
+
+                async def resolve_target(selector: str, hints: dict | None = None):
+                    """Return (frame, locator, used_key) using cache and multi-strategy resolution."""
+                    # Type is checked once; the [text=...] normalization below keeps a str a str
+                    is_str = isinstance(selector, str)
+                    # Build a stable cache key for strings or dicts; the JSON text (the persisted key) is
+                    # encoded once per distinct selector/hints pair and then looked up by a hashable twin
+                    if is_str and not hints:
+                        cache_key = selector
+                    else:
+                        frozen = (_freeze(selector), _freeze(hints) if hints else None)
+                        cache_key = cache_key_text.get(frozen)
+                        if cache_key is None:
+                            if hints:
+                                # include role/text hints in key to separate entries
+                                cache_key = json.dumps({"selector": selector, "hints": hints}, sort_keys=True)
+                            else:
+                                cache_key = json.dumps({"target": selector, "hints": {}}, sort_keys=True)
+                            cache_key_text[frozen] = cache_key
+
+                    # Same selector on the same, unchanged page: reuse the last answer, hit or miss
+                    forget_stale_pages()
+                    page_state = (cache_key, page.url, page_generation)
+                    trusted = resolved_on_page.get(page_state)
+                    if trusted and not trusted[0].is_detached():
+                        return trusted[0], trusted[1], cache_key
+                    missed_at = miss_cache.get(page_state)
+                    if missed_at is not None and time.monotonic() - missed_at < _MISS_TTL_S:
+                        return None, None, cache_key
+                    path_state = (cache_key, _url_path(page.url))
+                    remembered = resolved_on_path.get(path_state)
+                    if remembered and not remembered[0].is_detached():
+                        try:
+                            if await remembered[1].count() > 0:
+                                forget_stale_pages()
+                                resolved_on_page[(cache_key, page.url, page_generation)] = remembered
+                                remember_on_path(path_state, remembered)
+                                return remembered[0], remembered[1], cache_key
+                        except Exception:
+                            pass
+
+                    fr, loc = await probe_target(selector, is_str, cache_key)
+                    # Probing may open the user menu, so record against the page state as it is now
+                    forget_stale_pages()
+                    page_state = (cache_key, page.url, page_generation)
                     if fr:
-                        cache_put(cache_key, {"engine": "css", "value": selector["css"]})
-                        return fr, loc, cache_key
-
-            # 1) Native Playwright test id engine "data-testid=" style
-            m = re.match(r"^data-testid\s*=\s*['\"]?([\w\-:]+)['\"]?$", selector) if isinstance(selector, str) else None
-            if m:
-                fr, loc = await find_locator_any_frame({"engine": "testid", "value": m.group(1)})
-                if fr:
-                    cache_put(cache_key, {"engine": "testid", "value": m.group(1)})
+                        resolved_on_page[page_state] = (fr, loc)
+                        remember_on_path((cache_key, _url_path(page.url)), (fr, loc))
+                    else:
+                        miss_cache[page_state] = time.monotonic()
                     return fr, loc, cache_key
 
-            # 2) CSS as-is (handles [data-testid='...'] etc.)
-            if isinstance(selector, str) and any(c in selector for c in ("[", "]", ".", "#", ":", " ", ">")):
-                fr, loc = await find_locator_any_frame({"engine": "css", "value": selector})
-                if fr:
-                    cache_put(cache_key, {"engine": "css", "value": selector})
-                    return fr, loc, cache_key
+                async def probe_target(selector, is_str: bool, cache_key: str):
+                    """Run the selector cache and resolution strategies; return (frame, locator) or (None, None)."""
+                    # Normalizations
+                    if is_str and "[text=" in selector:
+                        # Convert [text='...'] into text=...
+                        m = _TEXT_BRACKET_RE.search(selector)
+                        if m:
+                            selector = f"text={m.group(1) or m.group(2)}"
 
-            # 3) text= engine
-            if isinstance(selector, str) and selector.startswith("text="):
-                text = selector.split("=", 1)[1]
-                fr, loc = await find_locator_any_frame({"engine": "text", "text": text})
-                if fr:
-                    cache_put(cache_key, {"engine": "text", "text": text})
-                    return fr, loc, cache_key
+                    cached = cache_get(cache_key)
+                    if cached:
+                        fr, loc = await find_locator_any_frame(cached)
+                        if fr:
+                            return fr, loc
 
-            # 3b) role= engine (e.g., role=table)
-            m_role = re.match(r"^role\s*=\s*([\w-]+)$", selector) if isinstance(selector, str) else None
-            if m_role:
-                role = m_role.group(1)
-                fr, loc = await find_locator_any_frame({"engine": "role", "role": role, "name_regex": ".*"})
-                if fr:
-                    cache_put(cache_key, {"engine": "role", "role": role, "name_regex": ".*"})
-                    return fr, loc, cache_key
+                    # Single-probe strategies, tried in table order
+                    if is_str:
+                        strategies = _STR_STRATEGIES
+                    elif isinstance(selector, dict):
+                        strategies = _DICT_STRATEGIES
+                    else:
+                        strategies = ()
+                    for applies, build in strategies:
+                        hit = applies(selector)
+                        if not hit:
+                            continue
+                        target = build(selector, hit)
+                        fr, loc = await find_locator_any_frame(target)
+                        if fr:
+                            cache_put(cache_key, target)
+                            return fr, loc
 
-            # 4) Try alternate attribute candidates for a slug
-            slug = selector.strip().strip("'").strip('"') if isinstance(selector, str) else ""
-            candidates_css = [
-                f"[data-testid='{slug}']",
-                f"[data-test-id='{slug}']",
-                f"[data-qa='{slug}']",
-                f"#{slug}",
-                f"[name='{slug}']",
-            ] if slug else []
-            for css in candidates_css:
-                fr, loc = await find_locator_any_frame({"engine": "css", "value": css})
-                if fr:
-                    cache_put(cache_key, {"engine": "css", "value": css})
-                    return fr, loc, cache_key
+                    # 4) Try alternate attribute candidates for a slug
+                    slug = selector.strip().strip("'").strip('"') if is_str else ""
+                    css_targets = [{"engine": "css", "value": css} for css in _slug_css_candidates(slug)] if slug else []
+                    if css_targets:
+                        fr, loc, target = await find_first_any_frame(css_targets)
+                        if fr:
+                            cache_put(cache_key, target)
+                            return fr, loc
 
-            # 5) Role + humanized name
-            human = slug_to_text(slug) if slug else ""
-            for role in ("menuitem", "link", "button"):
-                fr, loc = await find_locator_any_frame({"engine": "role", "role": role, "name_regex": re.escape(human)})
-                if fr:
-                    cache_put(cache_key, {"engine": "role", "role": role, "name_regex": re.escape(human)})
-                    return fr, loc, cache_key
+                    # 5) Role + humanized name
+                    human = slug_to_text(slug) if slug else ""
+                    human_regex = re.escape(human)
+                    fr, loc, target = await find_first_any_frame(
+                        [{"engine": "role", "role": role, "name_regex": human_regex} for role in ("menuitem", "link", "button")]
+                    )
+                    if fr:
+                        cache_put(cache_key, target)
+                        return fr, loc
 
-            # 6) Text contains humanized name
-            if human:
-                fr, loc = await find_locator_any_frame({"engine": "text", "text": human})
-                if fr:
-                    cache_put(cache_key, {"engine": "text", "text": human})
-                    return fr, loc, cache_key
+                    # 6) Text contains humanized name
+                    if human:
+                        fr, loc = await find_locator_any_frame({"engine": "text", "text": human})
+                        if fr:
+                            cache_put(cache_key, {"engine": "text", "text": human})
+                            return fr, loc
 
-            # 7) As absolute fallback, try opening user menu once then retry CSS candidates
-            await open_user_menu_if_needed()
-            for css in candidates_css:
-                fr, loc = await find_locator_any_frame({"engine": "css", "value": css})
-                if fr:
-                    cache_put(cache_key, {"engine": "css", "value": css})
-                    return fr, loc, cache_key
+                    # 7) As absolute fallback, try opening user menu once then retry CSS candidates
+                    await open_user_menu_if_needed()
+                    if css_targets:
+                        fr, loc, target = await find_first_any_frame(css_targets)
+                        if fr:
+                            cache_put(cache_key, target)
+                            return fr, loc
 
-            return None, None, cache_key
+                    return None, None
 
-        async def agent_repair(selector: str, context_hint: str = "") -> list[str]:
-            """Ask the agent for alternative selectors. Returns a list of suggested selectors."""
-            if not repair or not model_id or not region:
-                return []
-            try:
-                # Minimal, safe prompt: propose only CSS or test id forms
-                from .story_agent import bedrock_invoke_claude
-                prompt = (
-                    "You are a test selector repair assistant. Given a failed selector and a short page URL, propose up to 3 alternative selectors.\n"
-                    "Rules: Only output a JSON array of strings; each must be a CSS selector or data-testid form. No prose.\n\n"
-                    f"Failed selector: {selector}\n"
-                    f"Current URL: {context_hint}\n"
-                )
-                raw = bedrock_invoke_claude(prompt, model_id=model_id, region=region, verbose=verbose)
-                try:
-                    arr = json.loads(raw.strip().split("```")[-1]) if raw.strip().startswith("```") else json.loads(raw)
-                    if isinstance(arr, list):
-                        return [s for s in arr if isinstance(s, str) and s]
-                except Exception:
-                    return []
-            except Exception:
-                return []
-
-        async def resolve_with_repair(selector: str, hints: dict | None = None):
-            fr, loc, key = await resolve_target(selector, hints)
-            if fr:
-                return fr, loc, key
-            # Agent repair attempt once
-            suggestions = await agent_repair(selector, context_hint=page.url)
-            for sug in suggestions[:3]:
-                fr, loc, key2 = await resolve_target(sug, hints)
-                if fr:
-                    return fr, loc, key2
-            return None, None, key
-
-        for test in test_cases:
-            if verbose:
-                print(f"\n===== Running Test: {test.get('name','Unnamed')} =====")
-            status = "passed"
-            error = ""
-            screenshot = ""
-            try:
-                for step in test.get("steps", []):
+                repair_suggestions = {}
+
+                async def agent_repair(selector: str, context_hint: str = "") -> list[str]:
+                    """Ask the agent for alternative selectors. Returns a list of suggested selectors."""
+                    if not repair or not model_id or not region:
+                        return []
+                    # The prompt depends only on selector and URL, so the same failure on the same page is asked once per run
+                    repair_key = (_freeze(selector), context_hint)
+                    if repair_key in repair_suggestions:
+                        return repair_suggestions[repair_key]
+                    try:
+                        # Minimal, safe prompt: propose only CSS or test id forms
+                        prompt = (
+                            "You are a test selector repair assistant. Given a failed selector and a short page URL, propose up to 3 alternative selectors.\n"
+                            "Rules: Only output a JSON array of strings; each must be a CSS selector or data-testid form. No prose.\n\n"
+                            f"Failed selector: {selector_to_repair_string(selector)}\n"
+                            f"Current URL: {context_hint}\n"
+                        )
+                        # boto3 blocks; run it off the event loop so popups and cache flushes keep being served
+                        raw = await asyncio.to_thread(
+                            bedrock_invoke_claude, prompt, model_id=model_id, region=region, verbose=verbose,
+                            latency_optimized=latency_optimized, echo=log.debug,
+                        )
+                        try:
+                            m = _FENCE_RE.search(raw)
+                            arr = json.loads(m.group(1) if m else raw.strip())
+                            if isinstance(arr, list):
+                                repair_suggestions[repair_key] = [s for s in arr if isinstance(s, str) and s]
+                                return repair_suggestions[repair_key]
+                        except Exception:
+                            return []
+                    except Exception:
+                        return []
+
+                async def resolve_with_repair(selector: str, hints: dict | None = None):
+                    fr, loc, key = await resolve_target(selector, hints)
+                    if fr:
+                        return fr, loc, key
+                    # Agent repair attempt once
+                    suggestions = await agent_repair(selector, context_hint=page.url)
+                    for sug in suggestions[:3]:
+                        fr, loc, key2 = await resolve_target(sug, hints)
+                        if fr:
+                            return fr, loc, key2
+                    return None, None, key
+
+                # Step handlers, keyed by action name below; each returns a screenshot path if it took one
+                async def do_navigate(step: dict, test: dict):
+                    url = step.get("url") or step.get("target") or "/"
+                    target = url if url.startswith("http") else base_url.rstrip("/") + "/" + url.lstrip("/")
+                    await page.goto(target, timeout=60000)
+                    await wait_ready(page)
+                    await consent_dismiss(page, verbose=verbose)
+
+                async def do_login_via_login_gov(step: dict, test: dict):
+                    nonlocal session_logged_in, shared_session, last_login_window
+                    # Always ensure base page and consent before checking login
+                    await page.goto(base_url, timeout=60000)
+                    await wait_ready(page)
+                    await consent_dismiss(page, verbose=verbose)
+                    if session_logged_in:
+                        if verbose:
+                            log.debug("→ Session says logged in; skipping login_via_login_gov")
+                        return
+                    # Decide based on Login button visibility only
+                    should_login = await login_button_visible(page)
                     if verbose:
-                        print(f"→ Step: {step}")
-                    action = step.get("action")
-                    if action == "navigate":
-                        url = step.get("url", "/")
-                        target = url if url.startswith("http") else base_url.rstrip("/") + "/" + url.lstrip("/")
-                        await page.goto(target, timeout=60000)
-                        await page.wait_for_load_state("networkidle")
-                        await consent_dismiss(page, verbose=verbose)
-                    elif action == "login_via_login_gov":
-                        # Always ensure base page and consent before checking login
-                        await page.goto(base_url, timeout=60000)
-                        await page.wait_for_load_state("networkidle")
-                        await consent_dismiss(page, verbose=verbose)
-                        if session_logged_in:
-                            if verbose:
-                                print("→ Session says logged in; skipping login_via_login_gov")
-                        else:
-                            # Decide based on Login button visibility only
-                            should_login = await login_button_visible(page)
-                            if verbose:
-                                print(f"→ Login button visible: {should_login}")
-                            if not should_login:
-                                session_logged_in = True
+                        log.debug(f"→ Login button visible: {should_login}")
+                    if not should_login:
+                        session_logged_in = True
+                        if verbose:
+                            log.debug("→ No Login button; treating as logged in")
+                        return
+                    username = os.environ.get(step.get("username_env", "LOGIN_USERNAME"), "")
+                    password = os.environ.get(step.get("password_env", "LOGIN_PASSWORD"), "")
+                    secret = os.environ.get(step.get("totp_env", "TOTP_SECRET"), "")
+                    if not username or not password or not secret:
+                        raise AssertionError("Missing LOGIN_USERNAME/LOGIN_PASSWORD/TOTP_SECRET envs")
+                    async with login_lock:
+                        if shared_session:
+                            await context.add_cookies(shared_session["cookies"])
+                            await page.goto(base_url, timeout=60000)
+                            await wait_ready(page)
+                            await consent_dismiss(page, verbose=verbose)
+                            if not await login_button_visible(page):
                                 if verbose:
-                                    print("→ No Login button; treating as logged in")
-                            else:
-                                username = os.environ.get(step.get("username_env", "LOGIN_USERNAME"), "")
-                                password = os.environ.get(step.get("password_env", "LOGIN_PASSWORD"), "")
-                                secret = os.environ.get(step.get("totp_env", "TOTP_SECRET"), "")
-                                if not username or not password or not secret:
-                                    raise AssertionError("Missing LOGIN_USERNAME/LOGIN_PASSWORD/TOTP_SECRET envs")
-                                await click_login_button(page, verbose=verbose)
-                                await click_login_gov(page, verbose=verbose)
-                                await fill_credentials_and_submit(page, username, password, verbose=verbose)
-                                await handle_otp_and_consent(page, secret, (urllib.parse.urlparse(base_url).hostname or ""), verbose=verbose)
+                                    log.debug("→ Reused another lane's session")
                                 session_logged_in = True
-                    elif action in ("assert_text", "assert_text_present"):
-                        text = step.get("text")
-                        loc = page.get_by_text(text, exact=False).first
+                                return
+                        totp = _totp_for(secret)
+                        if last_login_window == int(time.time()) // totp.interval:
+                            # Login.gov accepts each code once
+                            await asyncio.sleep(_seconds_to_next_window(totp))
+                        await click_login_button(page, verbose=verbose)
+                        await click_login_gov(page, verbose=verbose)
+                        await fill_credentials_and_submit(page, username, password, verbose=verbose)
+                        await handle_otp_and_consent(page, secret, base_host, verbose=verbose)
+                        last_login_window = int(time.time()) // totp.interval
+                        shared_session = await context.storage_state()
+                    session_logged_in = True
+
+                async def do_assert_text(step: dict, test: dict):
+                    text = step.get("text")
+                    loc = page.get_by_text(text, exact=False).first
+                    await loc.wait_for(state="visible", timeout=8000)
+
+                async def do_assert_element(step: dict, test: dict):
+                    selector = step.get("selector") or step.get("target")
+                    fr, loc, key = await resolve_with_repair(selector, hints=None)
+                    if not fr:
+                        # Try opening user menu then retry
+                        await open_user_menu_if_needed()
+                        fr, loc, key = await resolve_with_repair(selector, hints=None)
+                    if not fr:
+                        raise AssertionError(f"Could not resolve selector: {selector}")
+                    expect_hidden = step.get("action") == "assert" and step.get("exists") is False
+                    if not expect_hidden:
+                        # Menu entries are often in the DOM but hidden until the menu is open
+                        await open_user_menu_for(selector, loc)
+                    try:
                         await loc.wait_for(state="visible", timeout=8000)
-                    elif action in ("assert_element_present", "assert_element_presence", "assert_element_exists", "assert_element_visible", "assert_element", "assert"):
-                        selector = step.get("selector") or step.get("target")
+                    except Exception:
+                        # Trigger repair on visibility timeout as well
                         fr, loc, key = await resolve_with_repair(selector, hints=None)
-                        if not fr:
-                            # Try opening user menu then retry
-                            await open_user_menu_if_needed()
-                            fr, loc, key = await resolve_with_repair(selector, hints=None)
-                        if not fr:
-                            raise AssertionError(f"Could not resolve selector: {selector}")
+                        await loc.wait_for(state="visible", timeout=5000)
+                    # Optional exists=false handling
+                    if expect_hidden:
+                        visible = False
                         try:
-                            await loc.wait_for(state="visible", timeout=8000)
+                            visible = await loc.is_visible()
                         except Exception:
-                            # Trigger repair on visibility timeout as well
-                            fr, loc, key = await resolve_with_repair(selector, hints=None)
-                            await loc.wait_for(state="visible", timeout=5000)
-                        # Optional exists=false handling
-                        if action == "assert" and step.get("exists") is False:
                             visible = False
-                            try:
-                                visible = await loc.is_visible()
-                            except Exception:
-                                visible = False
-                            if visible:
-                                raise AssertionError(f"Element should not be visible: {selector}")
-                    elif action == "click":
-                        selector = step.get("selector") or step.get("target")
+                        if visible:
+                            raise AssertionError(f"Element should not be visible: {selector}")
+
+                async def do_click(step: dict, test: dict):
+                    nonlocal page_generation
+                    selector = step.get("selector") or step.get("target")
+                    fr, loc, key = await resolve_with_repair(selector, hints=None)
+                    if not fr:
+                        await open_user_menu_if_needed()
                         fr, loc, key = await resolve_with_repair(selector, hints=None)
-                        if not fr:
-                            await open_user_menu_if_needed()
-                            fr, loc, key = await resolve_with_repair(selector, hints=None)
-                        if not fr:
-                            raise AssertionError(f"Could not resolve selector for click: {selector}")
-                        # If it is a link, ensure allowlisted
+                    if not fr:
+                        raise AssertionError(f"Could not resolve selector for click: {selector}")
+                    # Menu entries are often in the DOM but hidden until the menu is open
+                    await open_user_menu_for(selector, loc)
+                    # If it is a link, ensure allowlisted
+                    try:
+                        href = await loc.evaluate(_CLICK_HREF_JS, timeout=3000)
+                    except Exception:
+                        href = None
+                    if href and not host_allowed(href, page_host):
+                        raise AssertionError(f"Blocked click to external link: {href}")
+                    await loc.click(timeout=10000)
+                    page_generation += 1
+                    await wait_ready(page)
+
+                async def do_assert_url(step: dict, test: dict):
+                    expected = step.get("value") or step.get("target") or ""
+                    cur = page.url
+                    if expected and expected not in cur:
+                        raise AssertionError(f"URL '{cur}' does not contain '{expected}'")
+
+                async def do_screenshot(step: dict, test: dict):
+                    name = sanitize_for_filename(str(step.get("name") or test.get("name", "screenshot")))
+                    shot = screenshots_dir / f"{name}.jpg"
+                    return await save_screenshot(page, shot)
+
+                step_handlers = {
+                    "navigate": do_navigate,
+                    "navigate_to": do_navigate,
+                    "login_via_login_gov": do_login_via_login_gov,
+                    "assert_text": do_assert_text,
+                    "assert_text_present": do_assert_text,
+                    **dict.fromkeys((
+                        "assert_element_present", "assert_element_presence", "assert_element_exists",
+                        "assert_element_visible", "assert_element", "assert",
+                    ), do_assert_element),
+                    "click": do_click,
+                    "assert_url_matches": do_assert_url,
+                    "assert_url_contains": do_assert_url,
+                    "screenshot": do_screenshot,
+                }
+
+                for idx, test in lane:
+                    menu_opened_this_test = False
+                    test_name = test.get("name", "Unnamed")
+                    steps = test.get("steps", [])
+                    if verbose:
+                        log.debug(f"\n===== Running Test: {test_name} =====")
+                    status = "passed"
+                    error = ""
+                    screenshot = ""
+                    try:
+                        for step in steps:
+                            if verbose:
+                                log.debug(f"→ Step: {step}")
+                            action = step.get("action")
+                            handler = step_handlers.get(action)
+                            if handler is None:
+                                # Unknown action
+                                raise AssertionError(f"Unknown action in rewritten runner: {action}")
+                            shot = await handler(step, test)
+                            if shot:
+                                screenshot = shot
+                    except Exception as e:
+                        status = "failed"
+                        error = str(e)
+                        # Always print an error line to console
+                        current_url = ""
+                        try:
+                            current_url = page.url
+                        except Exception:
+                            current_url = ""
+                        log.warning(f"✖ Test failed: {test_name} — {error} (url={current_url})")
                         try:
-                            href = await loc.get_attribute("href")
-                            if href and not host_allowed(href, urllib.parse.urlparse(page.url).hostname or ""):
-                                raise AssertionError(f"Blocked click to external link: {href}")
+                            shot = screenshots_dir / (sanitize_for_filename(str(test.get("name", "failure")), "failure") + "_failure.jpg")
+                            screenshot = await save_screenshot(page, shot)
                         except Exception:
                             pass
-                        await loc.click(timeout=10000)
-                        await page.wait_for_load_state("networkidle")
-                    elif action in ("navigate_to", "navigate"):
-                        url = step.get("url") or step.get("target") or "/"
-                        target = url if url.startswith("http") else base_url.rstrip("/") + "/" + url.lstrip("/")
-                        await page.goto(target, timeout=60000)
-                        await page.wait_for_load_state("networkidle")
-                        await consent_dismiss(page, verbose=verbose)
-                    elif action in ("assert_url_matches", "assert_url_contains"):
-                        expected = step.get("value") or step.get("target") or ""
-                        cur = page.url
-                        if expected and expected not in cur:
-                            raise AssertionError(f"URL '{cur}' does not contain '{expected}'")
-                    elif action in ("screenshot",):
-                        name = step.get("name", test.get("name", "screenshot").replace(" ", "_").lower())
-                        shot = screenshots_dir / f"{name}.png"
-                        await page.screenshot(path=str(shot), full_page=True)
-                        screenshot = str(shot)
+
+                    result = {
+                        "name": test_name,
+                        "status": status,
+                        "error": error,
+                        "screenshot": screenshot,
+                        "steps": steps,
+                    }
+                    results.append((idx, result))
+                    # One line per finished test, in completion order, so an interrupted run keeps its results
+                    results_stream.write(orjson.dumps({"index": idx, **result}, option=orjson.OPT_APPEND_NEWLINE))
+                    results_stream.flush()
+                    # Print per-test summary to console
+                    if status == "passed":
+                        log.info(f"✓ Passed: {test_name}")
                     else:
-                        # Unknown action
-                        raise AssertionError(f"Unknown action in rewritten runner: {action}")
-            except Exception as e:
-                status = "failed"
-                error = str(e)
-                # Always print an error line to console
-                current_url = ""
-                try:
-                    current_url = page.url
-                except Exception:
-                    current_url = ""
-                print(f"✖ Test failed: {test.get('name','Unnamed')} — {error} (url={current_url})")
-                try:
-                    shot = screenshots_dir / (test.get("name", "failure").replace(" ", "_").lower() + "_failure.png")
-                    await page.screenshot(path=str(shot), full_page=True)
-                    screenshot = str(shot)
-                except Exception:
-                    pass
-
-            results.append({
-                "name": test.get("name", "Unnamed"),
-                "status": status,
-                "error": error,
-                "screenshot": screenshot,
-                "steps": test.get("steps", []),
-            })
-            # Print per-test summary to console
-            if status == "passed":
-                print(f"✓ Passed: {test.get('name','Unnamed')}")
-            else:
-                # Trim error for readability
-                err_excerpt = error if len(error) < 300 else (error[:297] + "...")
-                print(f"✖ Failed: {test.get('name','Unnamed')} — {err_excerpt}")
+                        # Trim error for readability
+                        err_excerpt = error if len(error) < 300 else (error[:297] + "...")
+                        log.warning(f"✖ Failed: {test_name} — {err_excerpt}")
+
+                return results
+            finally:
+                await context.close()
+
+        # Tests are dealt round-robin into lanes that run side by side; a single lane keeps the
+        # original sequential behavior, including a login carrying over to later tests
+        indexed_tests = list(enumerate(test_cases))
+        lane_count = min(max(1, concurrency), len(indexed_tests))
+        lanes = [indexed_tests[i::lane_count] for i in range(lane_count)]
+        try:
+            with open(run_dir / "results.jsonl", "wb") as results_stream:
+                lane_results = await asyncio.gather(*(run_lane(lane) for lane in lanes))
+        finally:
+            flush_cache()
+        results = sorted((r for rs in lane_results for r in rs), key=lambda r: r[0])
 
-        await browser.close()
-        return {"tests": results}
+        return {"tests": [result for _, result in results]}
+    finally:
+        log.removeHandler(console)
+        console.close()
 
 
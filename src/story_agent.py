@@ -1,5 +1,12 @@
 import json
+import re
+import threading
+
 import boto3
+import orjson
+
+# Everything from the first [ to the last ], fenced or not
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.S)
 
 
 def build_prompt(story_text: str, base_url: str) -> str:
@@ -27,11 +34,23 @@ def build_prompt(story_text: str, base_url: str) -> str:
     )
 
 
-def bedrock_invoke_claude(prompt: str, model_id: str, region: str, verbose: bool = False) -> str:
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+def bedrock_client(region: str):
+    """Shared bedrock-runtime client per region; clients are thread-safe, but creating them on boto3's default session is not."""
+    with _clients_lock:
+        client = _clients.get(region)
+        if client is None:
+            client = _clients[region] = boto3.session.Session().client("bedrock-runtime", region_name=region)
+        return client
+
+
+def bedrock_invoke_claude(prompt: str, model_id: str, region: str, verbose: bool = False, latency_optimized: bool = False, echo=print) -> str:
+    # echo receives each verbose block whole; the runner passes its logger so these stay in order with step logs
     if verbose:
-        print("\n===== Agent Prompt (to Bedrock) =====")
-        print(prompt)
-        print("===== End Prompt =====\n")
+        echo(f"\n===== Agent Prompt (to Bedrock) =====\n{prompt}\n===== End Prompt =====\n")
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "messages": [
@@ -39,42 +58,36 @@ def bedrock_invoke_claude(prompt: str, model_id: str, region: str, verbose: bool
         ],
         "max_tokens": 2000,
     }
-    client = boto3.client("bedrock-runtime", region_name=region)
+    client = bedrock_client(region)
+    kwargs = {}
+    if latency_optimized:
+        # Only some models/regions serve optimized inference; Bedrock rejects the request otherwise
+        kwargs["performanceConfigLatency"] = "optimized"
     resp = client.invoke_model(
         body=json.dumps(body).encode("utf-8"),
         modelId=model_id,
         accept="application/json",
         contentType="application/json",
+        **kwargs,
     )
     raw = resp["body"].read().decode("utf-8")
-    parsed = json.loads(raw)
+    parsed = orjson.loads(raw)
     text = ""
     if isinstance(parsed.get("content"), list):
         for item in parsed["content"]:
             if item.get("type") == "text":
                 text += item.get("text", "")
     if verbose:
-        print("\n===== Agent Raw Response =====")
-        print(text)
-        print("===== End Raw Response =====\n")
+        echo(f"\n===== Agent Raw Response =====\n{text}\n===== End Raw Response =====\n")
     return text.strip()
 
 
 def coerce_to_json_array(text: str) -> list:
-    cleaned = text.strip()
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[7:]
-    elif cleaned.startswith("```"):
-        cleaned = cleaned[3:]
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3]
-    # keep only content between the first [ and last ]
-    start = cleaned.find("[")
-    end = cleaned.rfind("]")
-    if start != -1 and end != -1 and end > start:
-        cleaned = cleaned[start : end + 1]
+    m = _JSON_ARRAY_RE.search(text)
+    if not m:
+        return []
     try:
-        arr = json.loads(cleaned)
+        arr = orjson.loads(m.group(0))
         if isinstance(arr, list):
             return arr
     except Exception:
@@ -82,9 +95,9 @@ def coerce_to_json_array(text: str) -> list:
     return []
 
 
-def generate_test_cases_from_story(story_text: str, base_url: str, model_id: str, region: str, verbose: bool = False) -> list:
+def generate_test_cases_from_story(story_text: str, base_url: str, model_id: str, region: str, verbose: bool = False, latency_optimized: bool = False) -> list:
     prompt = build_prompt(story_text, base_url)
-    raw = bedrock_invoke_claude(prompt, model_id=model_id, region=region, verbose=verbose)
+    raw = bedrock_invoke_claude(prompt, model_id=model_id, region=region, verbose=verbose, latency_optimized=latency_optimized)
     tests = coerce_to_json_array(raw)
     if verbose:
         print("===== Parsed Test Cases (JSON) =====")